@@ -0,0 +1,360 @@
+"""Daten, Persistenz und Kartenaufbau der Makerspace-App (ohne UI).
+
+Kann importiert werden, ohne dass Streamlit-Seitenelemente entstehen;
+die Oberfläche selbst liegt in app.py.
+"""
+from __future__ import annotations
+
+import os, re, gzip, time, hashlib, tempfile, threading
+from pathlib import Path
+
+import ijson
+import orjson
+import pandas as pd
+import requests
+import streamlit as st
+import folium
+from jinja2 import Template
+from folium.plugins import MarkerCluster, Fullscreen, LocateControl
+
+# -------------------------------------------------------------------
+# Konfiguration
+# -------------------------------------------------------------------
+PERSIST_DIR     = Path("/mount/src")
+
+SCHOOL_CACHE    = PERSIST_DIR / "schools_bavaria.parquet"
+SCHOOL_CSV      = PERSIST_DIR / "schools_bavaria.csv"   # Altformat, wird migriert
+SPACE_FILE      = PERSIST_DIR / "makerspaces.json"
+DB_SCHEMA       = 2        # 1 = Einträge als [dict], 2 = dict + "_schema"-Marke
+MEDIEN_CACHE    = PERSIST_DIR / "medienzentren.csv"
+OVERPASS_RAW    = PERSIST_DIR / "overpass_raw.json.gz"   # Rohelemente der letzten Abfrage
+OVERPASS_TTL    = 7 * 86400                              # so lange nicht neu abfragen (s)
+OVERPASS_URL   = "https://overpass-api.de/api/interpreter"
+OVERPASS_QUERY = """[out:json][timeout:120];
+area["ISO3166-2"="DE-BY"]->.searchArea;
+(
+  node["amenity"="school"](area.searchArea);
+  way ["amenity"="school"](area.searchArea);
+  relation["amenity"="school"](area.searchArea);
+);
+out center tags;
+"""
+
+# -------------------------------------------------------------------
+# Helfer
+# -------------------------------------------------------------------
+def _atomic_write(path: Path, data: bytes) -> None:
+    """Schreibt über eine Temp-Datei + os.replace – nie eine halbe Datei.
+    Eigene Temp-Datei je Aufruf, damit parallele Sessions sich nicht stören."""
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=path.name + ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        Path(tmp).unlink(missing_ok=True)
+        raise
+
+# Reihenfolge = Priorität (erster Treffer gewinnt)
+SCHOOL_TYPE_PATTERNS = {
+    "Gymnasium": r"gymnasium",
+    "Grundschule": r"grundschule",
+    "Realschule": r"realschule",
+    "Mittelschule": r"mittelschule|hauptschule",
+    "Berufsschule": r"berufsschule",
+    "FOS/BOS": r"fachoberschule|berufsoberschule|fos|bos",
+    "Wirtschaftsschule": r"wirtschaftsschule",
+    "Förderschule": r"förderschule|sonderpädagogisch",
+    "Sonstige": r"",                              # Auffangtyp, passt immer
+}
+# Feste Kategorien: Typspalte als int8-Codes statt je Zeile ein String
+SCHOOL_TYPE_DTYPE = pd.CategoricalDtype(list(SCHOOL_TYPE_PATTERNS))
+
+# Eine Regex für alle Schularten: je Typ ein Lookahead mit benannter Gruppe,
+# die Alternation probiert sie in Prioritätsreihenfolge.
+_GROUP_TO_LABEL = {f"t{i}": typ for i, typ in enumerate(SCHOOL_TYPE_PATTERNS)}
+_TYPE_RE = re.compile(
+    r"\A(?:" + "|".join(f"(?=.*?(?P<t{i}>{pat}))"
+                        for i, pat in enumerate(SCHOOL_TYPE_PATTERNS.values()))
+    + ")",
+    re.DOTALL | re.IGNORECASE,
+)
+
+def school_type_from_name(name: str) -> str:
+    return _GROUP_TO_LABEL[_TYPE_RE.match(name).lastgroup]
+
+def school_types(names: pd.Series) -> pd.Series:
+    """Wie school_type_from_name, aber vektorisiert für eine ganze Spalte."""
+    # genau eine Gruppe je Zeile ist gesetzt (dank Auffangtyp) – außer bei
+    # fehlendem Namen: dort wäre die Zeile leer und idxmax lieferte t0
+    types = names.str.extract(_TYPE_RE).notna().idxmax(axis=1).map(_GROUP_TO_LABEL)
+    return types.where(names.notna(), "Sonstige")
+
+# -------------------------------------------------------------------
+# Schuldaten laden (Parquet-Cache)
+# -------------------------------------------------------------------
+@st.cache_resource(show_spinner="📡 Lade Schulen …")
+def load_schools() -> pd.DataFrame:
+    """Schulen nach Name sortiert (Typ kategorial) – Auswahllisten sortieren nicht.
+    Ein gemeinsames Objekt für alle Sessions (kein Kopieren je Rerun): nur lesen!"""
+    if SCHOOL_CACHE.exists():
+        return _prepare(pd.read_parquet(SCHOOL_CACHE, engine="pyarrow"))
+
+    if SCHOOL_CSV.exists():                       # einmalige Migration
+        # Namen wörtlich nehmen: "NA" oder "null" sind Schulnamen, kein NaN
+        df = pd.read_csv(SCHOOL_CSV, keep_default_na=False,
+                         na_values={"lat": [""], "lon": [""]})
+        if "type" not in df.columns:
+            df["type"] = school_types(df["name"])
+        df = _prepare(df)
+        _write_school_cache(df)
+        return df
+
+    raw = pd.DataFrame(_overpass_elements(),
+                       columns=["lat", "lon", "center", "name"])
+    pts = pd.DataFrame({
+        "name": raw["name"],
+        "lat" : raw["lat"].fillna(raw["center"].str.get("lat")),
+        "lon" : raw["lon"].fillna(raw["center"].str.get("lon")),
+    }).dropna()
+    # Dubletten (gleicher Name, Koordinate auf ~1 m gleich) per dict entfernen
+    uniq = dict.fromkeys(zip(pts["name"], pts["lat"].round(5), pts["lon"].round(5)))
+    df   = pd.DataFrame(list(uniq), columns=["name", "lat", "lon"])
+    df["type"] = school_types(df["name"])
+    df = _prepare(df)
+    _write_school_cache(df)
+    return df
+
+def _overpass_elements() -> list[list]:
+    """[lat, lon, center, name] je Schule – von der Platte, solange jünger als
+    OVERPASS_TTL, sonst frisch von Overpass (und wieder auf die Platte)."""
+    if (OVERPASS_RAW.exists()
+            and time.time() - OVERPASS_RAW.stat().st_mtime < OVERPASS_TTL):
+        els = orjson.loads(gzip.decompress(OVERPASS_RAW.read_bytes()))
+        if els:                                   # leere Altdatei: neu abfragen
+            return els
+
+    # Antwort gzip-komprimiert holen und Elemente direkt aus dem Stream parsen,
+    # statt erst den kompletten Body zu puffern und dann zu dekodieren.
+    # Von jedem Element bleibt nur, was gebraucht wird – die Tags nicht.
+    with requests.Session() as s:
+        s.headers.update({"Accept": "application/json",
+                          "Accept-Encoding": "gzip, deflate"})
+        with s.post(OVERPASS_URL, data={"data": OVERPASS_QUERY}, stream=True) as r:
+            r.raise_for_status()
+            r.raw.decode_content = True
+            els = [[el.get("lat"), el.get("lon"), el.get("center"),
+                    el.get("tags", {}).get("name")]
+                   for el in ijson.items(r.raw, "elements.item", use_float=True)]
+    # Fehler-/Timeout-Antworten kommen mit 200, aber ohne Elemente (nur "remark")
+    # – nichts cachen, sonst bliebe die Karte 7 Tage lang leer.
+    if not els:
+        raise RuntimeError("Overpass lieferte keine Schulen (Timeout oder Fehler) "
+                           "– später erneut versuchen.")
+    _atomic_write(OVERPASS_RAW, gzip.compress(orjson.dumps(els)))
+    return els
+
+def _write_school_cache(df: pd.DataFrame) -> None:
+    _atomic_write(SCHOOL_CACHE,
+                  df.to_parquet(engine="pyarrow", index=False, compression="zstd"))
+
+def _prepare(df: pd.DataFrame) -> pd.DataFrame:
+    # Unbekannte Typen (z. B. aus einer alten CSV) landen bei "Sonstige"
+    df["type"] = df["type"].astype(SCHOOL_TYPE_DTYPE).fillna("Sonstige")
+    # stabil, damit gleichnamige Schulen ihre Reihenfolge behalten
+    return df.sort_values("name", kind="stable", ignore_index=True)
+
+# -------------------------------------------------------------------
+# Makerspace-DB laden / initialisieren
+# -------------------------------------------------------------------
+# Aus der DB abgeleiteter Cache: je Schule (Kopie des Eintrags, Ergebnis).
+# Gültig, solange der Eintrag inhaltlich gleich ist – auch über ein Neuladen
+# der Datei hinweg; neu kodiert wird so nur, was sich wirklich geändert hat.
+@st.cache_resource
+def _entry_bytes() -> dict[str, tuple[dict, bytes]]:
+    """Serialisierte Einträge je Schule (prozessweit, überlebt Reruns)."""
+    return {}
+
+# Sessions laufen in eigenen Threads: Lesen-Ändern-Schreiben der DB seriell
+_DB_LOCK = threading.RLock()
+
+def save_db(db: dict[str, dict]) -> None:
+    """Schreibt die DB; nur geänderte Einträge werden neu kodiert. Ergebnis ist
+    bytegleich zu orjson.dumps({"_schema": DB_SCHEMA, **db}, OPT_INDENT_2)."""
+    with _DB_LOCK:
+        cache = _entry_bytes()
+        parts = [b'  "_schema": %d' % DB_SCHEMA]
+        for k, v in db.items():
+            hit = cache.get(k)
+            if hit is None or hit[0] != v:
+                # '{\n  "k": …\n}' -> '  "k": …'
+                enc = orjson.dumps({k: v}, option=orjson.OPT_INDENT_2)[2:-2]
+                hit = cache[k] = (dict(v), enc)
+            parts.append(hit[1])
+        _atomic_write(SPACE_FILE, b"{\n" + b",\n".join(parts) + b"\n}")
+
+def names_hash(names: pd.Series) -> bytes:
+    row_hashes = pd.util.hash_pandas_object(names, index=False).to_numpy()
+    return hashlib.blake2b(row_hashes.tobytes(), digest_size=8).digest()
+
+@st.cache_resource(show_spinner=False)
+def school_list_key() -> bytes:
+    """names_hash der Schulliste, einmal je Prozess statt bei jedem Rerun."""
+    return names_hash(load_schools()["name"])
+
+def space_file_stamp() -> tuple[int, int]:
+    """(mtime_ns, Größe) der DB-Datei. Die Größe fängt Schreibvorgänge ab, die
+    auf Dateisystemen mit grober Zeitauflösung dieselbe mtime bekommen."""
+    if not SPACE_FILE.exists():
+        return (0, 0)
+    stat = SPACE_FILE.stat()
+    return (stat.st_mtime_ns, stat.st_size)
+
+def _read_db(schools: pd.DataFrame) -> tuple[dict[str, dict], bool]:
+    """DB frisch von der Platte, migriert und um neue Schulen ergänzt;
+    zweiter Wert: muss zurückgeschrieben werden."""
+    db      = orjson.loads(SPACE_FILE.read_bytes()) if SPACE_FILE.exists() else {}
+    changed = db.pop("_schema", 1) != DB_SCHEMA
+    if changed:                                # einmalige Migration
+        for k, v in db.items():
+            if isinstance(v, list):            # Schema 1: [eintrag]
+                db[k] = v[0]
+    # Nur wirklich neue Schulen machen die Datei "dirty".
+    missing = [n for n in schools["name"].tolist() if n not in db]
+    if missing:
+        db.update((n, {}) for n in missing)
+        changed = True
+    return db, changed
+
+@st.cache_resource(show_spinner=False, max_entries=1)   # nur der aktuelle Dateistand
+def load_db(_schools: pd.DataFrame, stamp: tuple[int, int],
+            schools_hash: bytes) -> dict[str, dict]:
+    """Prozessweit gecacht; neu geladen, sobald sich Datei oder Schulliste ändern.
+    Nur lesen – geändert wird über update_entry."""
+    # Lesen + Zurückschreiben unter dem Lock, sonst überschriebe ein altes db
+    # ein update_entry dazwischen. Lock-Reihenfolge immer Cache-Lock -> _DB_LOCK
+    # (update_entry ruft load_db nie unter _DB_LOCK) – kein Verklemmen.
+    with _DB_LOCK:
+        db, changed = _read_db(_schools)
+        if changed:
+            save_db(db)
+    return db
+
+def update_entry(schools: pd.DataFrame, school: str, entry: dict) -> bool:
+    """Setzt den Eintrag einer Schule auf dem aktuellen Dateistand und schreibt;
+    False, wenn er schon so drinsteht. Liest unter dem Lock selbst von der
+    Platte (nicht über load_db, dessen Cache-Lock sonst verklemmen kann) und
+    lässt das gecachte Dict unangetastet, falls das Schreiben scheitert."""
+    with _DB_LOCK:
+        cur, changed = _read_db(schools)
+        if cur.get(school) == entry and not changed:
+            return False
+        cur[school] = entry
+        save_db(cur)
+    load_db.clear()           # neu laden, auch falls der Stempel gleich bliebe
+    return True
+
+# -------------------------------------------------------------------
+# Auswahllisten (sortiert, gecacht statt bei jedem Rerun neu sortiert)
+# -------------------------------------------------------------------
+def of_types(schools: pd.DataFrame, types: tuple[str, ...]) -> pd.DataFrame:
+    """Schulen der gewählten Typen. Maske per Nachschlagen der int8-Codes in
+    einer Tabelle je Kategorie – kein Stringvergleich, kein isin-Hashing."""
+    wanted = SCHOOL_TYPE_DTYPE.categories.isin(types)
+    return schools[wanted[schools["type"].cat.codes.to_numpy()]]
+
+@st.cache_data(show_spinner=False)
+def type_options(_schools: pd.DataFrame, schools_hash: bytes) -> list[str]:
+    return sorted(_schools["type"].unique())
+
+@st.cache_data(show_spinner=False)
+def name_options(_schools: pd.DataFrame, schools_hash: bytes,
+                 types: tuple[str, ...]) -> list[str]:
+    df = _schools if not types else of_types(_schools, types)
+    return df["name"].tolist()                    # load_schools sortiert bereits
+
+# -------------------------------------------------------------------
+# Karte bauen
+# -------------------------------------------------------------------
+# Baut einen Marker aus einer Zeile [lat, lon, name, typ, eintrag|0]
+# (gleicher Vertrag wie der callback von folium.plugins.FastMarkerCluster).
+# Das Popup-HTML entsteht erst beim Öffnen – die meisten werden nie angesehen.
+SCHOOL_MARKER_JS = """
+function(row){
+  var info = row[4], col = info ? 'green' : 'red';
+  return L.circleMarker([row[0], row[1]],
+                        {radius:6, color:col, fill:true, fillColor:col,
+                         fillOpacity:0.9, hasSpace:!!info})
+          .bindPopup(function(){
+            var h = `<b>${row[2]}</b><br><i>${row[3]}</i>`;
+            if (!info) return h + '<br><i>Kein Makerspace eingetragen.</i>';
+            if (info.contact) h += `<br><b>Kontakt:</b> ${info.contact}`;
+            if (info.email)   h += `<br><b>Email:</b> <a href='mailto:${info.email}'>${info.email}</a>`;
+            if (info.website) h += `<br><b>Web:</b> <a href='${info.website}' target='_blank'>${info.website}</a>`;
+            return h + `<hr style='margin:4px 0;'><i>${info.space_name}</i>`
+                     + `<br>Werkzeuge: ${(info.tools || []).join(', ') || '–'}`;
+          }, {maxWidth:300});
+}"""
+
+# Cluster grün, sobald eine enthaltene Schule einen Makerspace hat
+CLUSTER_ICON_JS = (
+    "function(c){"
+    "var col=c.getAllChildMarkers().some(m=>m.options.hasSpace)?'green':'red';"
+    "return L.divIcon({html:`<div style='background:${col};border-radius:50%;"
+    "width:32px;height:32px;display:flex;align-items:center;"
+    "justify-content:center;color:white;font-weight:bold;'>"
+    "${c.getChildCount()}</div>`});}"
+)
+
+class SchoolMarkers(folium.MacroElement):
+    """Wie FastMarkerCluster: Zeilen + JS-callback, Marker entstehen im Browser.
+    Anders als dort gehen sie gesammelt per addLayers in den Cluster."""
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+        (function(){
+          var callback = {{ this.callback }};
+          var rows = {{ this.data }}, markers = new Array(rows.length);
+          for (var i = 0; i < rows.length; i++) markers[i] = callback(rows[i]);
+          {{ this._parent.get_name() }}.addLayers(markers);
+        })();
+        {% endmacro %}
+    """)
+
+    def __init__(self, rows: list[list], callback: str = SCHOOL_MARKER_JS):
+        super().__init__()
+        self._name    = "SchoolMarkers"
+        self.callback = callback.strip()
+        self.data     = orjson.dumps(rows).decode().replace("</", "<\\/")
+
+def build_map(df: pd.DataFrame, spaces: dict[str, dict]) -> folium.Map:
+    # Canvas statt je Marker ein SVG-Element im DOM
+    m = folium.Map(location=[48.97, 11.5], zoom_start=7, prefer_canvas=True)
+
+    cluster = MarkerCluster(
+        options=dict(showCoverageOnHover=False, chunkedLoading=True,
+                     chunkInterval=50, chunkDelay=10),
+        icon_create_function=CLUSTER_ICON_JS,
+    ).add_to(m)
+
+    with_space = {k for k, v in spaces.items() if v.get("space_name")}
+    names, types = df["name"].tolist(), df["type"].tolist()
+    lats,  lons  = df["lat"].tolist(),  df["lon"].tolist()
+    has          = df["name"].isin(with_space).tolist()
+
+    # Einträge nur für Schulen mit Makerspace mitschicken, sonst 0
+    rows = [[lat, lon, name, typ, spaces[name] if has_space else 0]
+            for name, typ, lat, lon, has_space in zip(names, types, lats, lons, has)]
+
+    SchoolMarkers(rows).add_to(cluster)
+
+    Fullscreen().add_to(m)
+    LocateControl().add_to(m)
+    return m
+
+@st.cache_data(show_spinner="🗺️ Baue Karte …", max_entries=8)   # LRU über Filter/DB-Stände
+def render_map_html(_schools: pd.DataFrame, _db: dict[str, dict],
+                    types: tuple[str, ...], stamp: tuple[int, int],
+                    schools_hash: bytes) -> str:
+    """Fertiges Karten-HTML; Filter + DB-Stand bestimmen die Karte vollständig."""
+    df = of_types(_schools, types)
+    return build_map(df, _db).get_root().render()